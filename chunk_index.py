@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from config import CHUNK_INDEX_PATH, PARENT_MAX_CHARS
+
+# --- CHUNK-NEIGHBOR INDEX (SMALL-TO-BIG RETRIEVAL) ---
+# Cấu trúc file JSON:
+# {
+#   "sources": {"<file_path>": {"chunks": [chunk_id, ...], "parents": [parent_id, ...]}},
+#   "parents": {"<parent_id>": "<text của cả section>"}
+# }
+# Thứ tự trong "chunks" chính là prev/next, "parents" song song với "chunks".
+
+
+def source_key(source):
+    return hashlib.md5(source.encode("utf-8")).hexdigest()[:12]
+
+
+def load_index(path=CHUNK_INDEX_PATH):
+    index = {"sources": {}, "parents": {}}
+    if os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️  Index chunk hỏng, bỏ qua: {e}")
+
+    # Tra ngược chunk_id -> (source, vị trí) để tìm hàng xóm cho nhanh
+    index["lookup"] = {}
+    for source, entry in index["sources"].items():
+        for pos, chunk_id in enumerate(entry["chunks"]):
+            index["lookup"][chunk_id] = (source, pos)
+    return index
+
+
+def save_index(index, path=CHUNK_INDEX_PATH):
+    """Ghi ra file tạm cùng folder rồi os.replace để bị kill giữa chừng cũng không để lại index dở dang."""
+    folder = os.path.dirname(path) or "."
+    os.makedirs(folder, exist_ok=True)
+    data = {"sources": index["sources"], "parents": index["parents"]}
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".chunk_index-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def index_source(index, source, chunks, parent_texts):
+    """
+    Gán chunk_id/parent_id cho các chunk của một file và ghi vào index (thay thế bản cũ).
+    Mỗi chunk phải có metadata["section"] trỏ vào parent_texts.
+    Trả về list chunk_id cũ không còn dùng.
+    """
+    key = source_key(source)
+    old_entry = index["sources"].pop(source, None)
+    old_ids = []
+    if old_entry:
+        old_ids = old_entry["chunks"]
+        for parent_id in set(old_entry["parents"]):
+            index["parents"].pop(parent_id, None)
+        for chunk_id in old_ids:
+            index["lookup"].pop(chunk_id, None)
+
+    chunk_ids = []
+    parent_ids = []
+    for pos, chunk in enumerate(chunks):
+        chunk_id = f"{key}-{pos}"
+        parent_id = f"{key}-p{chunk.metadata.pop('section', 0)}"
+        chunk.metadata["chunk_id"] = chunk_id
+        chunk.metadata["parent_id"] = parent_id
+        chunk_ids.append(chunk_id)
+        parent_ids.append(parent_id)
+        index["lookup"][chunk_id] = (source, pos)
+
+    for section, text in enumerate(parent_texts):
+        parent_id = f"{key}-p{section}"
+        if parent_id in parent_ids:
+            index["parents"][parent_id] = text
+
+    index["sources"][source] = {"chunks": chunk_ids, "parents": parent_ids}
+    new_ids = set(chunk_ids)
+    return [chunk_id for chunk_id in old_ids if chunk_id not in new_ids]
+
+
+def neighbor_ids(index, chunk_id):
+    """Trả về (prev_id, next_id) trong cùng file, None nếu ở biên."""
+    if chunk_id not in index["lookup"]:
+        return None, None
+    source, pos = index["lookup"][chunk_id]
+    chunks = index["sources"][source]["chunks"]
+    prev_id = chunks[pos - 1] if pos > 0 else None
+    next_id = chunks[pos + 1] if pos + 1 < len(chunks) else None
+    return prev_id, next_id
+
+
+def strip_injected_context(text):
+    """Bỏ phần header đã inject (DAILY LOG/SOURCE DOCUMENT ... ---) để hàng xóm không lặp header."""
+    return text.split("\n---\n", 1)[-1]
+
+
+def expand_docs(docs, index, fetch_chunks=None):
+    """
+    Mở rộng các chunk thắng rerank thành context cho prompt.
+    - Section cha đủ nhỏ (<= PARENT_MAX_CHARS) thì lấy nguyên section, các chunk cùng section chỉ lấy 1 lần.
+    - Section quá to thì chỉ lấy cửa sổ prev/self/next trong cùng section (fetch_chunks: list id -> {id: text}).
+    - Chunk không có trong index (DB cũ) thì giữ nguyên page_content.
+    """
+    texts = []
+    seen = set()
+
+    for doc in docs:
+        chunk_id = doc.metadata.get("chunk_id")
+        parent_id = doc.metadata.get("parent_id")
+        parent_text = index["parents"].get(parent_id)
+
+        # Section cha không chứa chunk (index cũ, chunk vắt qua 2 section) thì đừng đánh mất đoạn đã match
+        if parent_text is not None and strip_injected_context(doc.page_content) not in parent_text:
+            parent_text = None
+
+        if parent_text is not None and len(parent_text) <= PARENT_MAX_CHARS:
+            if parent_id not in seen:
+                seen.add(parent_id)
+                texts.append(parent_text)
+            continue
+
+        if parent_text is None or chunk_id not in index["lookup"] or fetch_chunks is None:
+            texts.append(doc.page_content)
+            continue
+        if chunk_id in seen:
+            continue
+        seen.add(chunk_id)
+
+        # Chỉ nối hàng xóm cùng section để không lạc đề
+        source, _ = index["lookup"][chunk_id]
+        prev_id, next_id = neighbor_ids(index, chunk_id)
+        same_section = [
+            nid
+            for nid in (prev_id, next_id)
+            if nid and index["sources"][source]["parents"][index["lookup"][nid][1]] == parent_id
+        ]
+        neighbors = fetch_chunks(same_section) if same_section else {}
+
+        parts = []
+        if prev_id in neighbors:
+            parts.append(strip_injected_context(neighbors[prev_id]))
+        parts.append(doc.page_content)
+        if next_id in neighbors:
+            parts.append(strip_injected_context(neighbors[next_id]))
+        texts.append("\n...\n".join(parts))
+
+    return texts
@@ -19,6 +19,19 @@ EMBEDDING_MODEL_NAME = "nomic-embed-text"
 VECTOR_DB_PATH = "./chroma_db"
 COLLECTION_NAME = "rag_notes"
 
+# --- SMALL-TO-BIG RETRIEVAL ---
+# Index chunk -> section cha + hàng xóm, nằm chung folder DB để xóa DB là xóa luôn index
+CHUNK_INDEX_PATH = os.path.join(VECTOR_DB_PATH, "chunk_index.json")
+RETRIEVE_K = 12  # Số chunk nhỏ lấy từ vector DB để rerank
+RERANK_TOP_N = 4  # Số chunk thắng rerank được mở rộng thành section cha
+PARENT_MAX_CHARS = 3000  # Section to hơn mức này thì chỉ lấy cửa sổ prev/self/next
+INDEX_SAVE_EVERY = 20  # Số file enrich xong mới ghi index 1 lần (ghi index là dump lại cả file JSON)
+
+# --- PROFILING (--profile) ---
+PROFILE_DIR = "./profiles"
+PROFILE_SAMPLE_INTERVAL = 0.005  # Giây giữa 2 lần lấy mẫu stack
+PROFILE_TOP_N = 20  # Số hàm nóng / file chậm in ra trong summary
+
 # --- SYSTEM PATHS ---
 NOTES_DIRECTORY = os.getenv("NOTES_DIR", "/home/daniel/Projects/mind_dump/")
 
@@ -1,18 +1,32 @@
+import argparse
 import hashlib
 import json
 import os
 import re
+import time
 
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
 from langchain_ollama import ChatOllama, OllamaEmbeddings
 from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
 
+from chunk_index import index_source, load_index, save_index
+
 # Import Config
-from config import COLLECTION_NAME, EMBEDDING_MODEL_NAME, LOCAL_MODEL_NAME, NOTES_DIRECTORY, VECTOR_DB_PATH
+from config import (
+    COLLECTION_NAME,
+    EMBEDDING_MODEL_NAME,
+    INDEX_SAVE_EVERY,
+    LOCAL_MODEL_NAME,
+    NOTES_DIRECTORY,
+    VECTOR_DB_PATH,
+)
+from profiler import Profiler, add_profile_argument
 
 METADATA_PATTERN = re.compile(r"<!--\s*AI_METADATA(.*?)-->", re.DOTALL)
 DAILY_NOTE_PATTERN = re.compile(r"^\d{8}\.md$")
+SECTION_HEADER_PATTERN = re.compile(r"^#{1,3} ")
+CODE_FENCE_PATTERN = re.compile(r"^\s*(```+|~~~+)")
 
 
 def calculate_file_hash(content):
@@ -67,6 +81,8 @@ Content-Hash: {file_hash}
 
 
 # --- CHUNKING STRATEGY (NÂNG CẤP) ---
+# Các hàm chunk trả về (chunks, parent_texts): mỗi chunk có metadata["section"] trỏ vào section cha
+# để main.py rerank trên chunk nhỏ rồi mới mở rộng ra cả section lúc build prompt.
 
 
 def chunk_daily_note(content, source):
@@ -82,6 +98,7 @@ def chunk_daily_note(content, source):
         initial_docs = [Document(page_content=content, metadata={})]
 
     final_docs = []
+    parent_texts = []
 
     # B2: Cắt mịn (Recursive) nếu chunk còn quá to
     recursive_splitter = RecursiveCharacterTextSplitter(
@@ -92,7 +109,7 @@ def chunk_daily_note(content, source):
 
     base_metadata = {"source": source, "type": "daily_log"}
 
-    for doc in initial_docs:
+    for section, doc in enumerate(initial_docs):
         # Lấy Topic từ Header (nếu có)
         topic = doc.metadata.get("Topic", "General Log")
         sub = doc.metadata.get("Sub-topic", "")
@@ -103,6 +120,9 @@ def chunk_daily_note(content, source):
         if sub:
             context_str += f" > {sub}"
 
+        # Section cha = nguyên đoạn dưới heading này
+        parent_texts.append(f"{context_str}\n---\n{doc.page_content}")
+
         # Nếu chunk này dài quá 800 ký tự -> Cắt nhỏ tiếp
         if len(doc.page_content) > 1000:
             sub_chunks = recursive_splitter.create_documents([doc.page_content])
@@ -111,101 +131,206 @@ def chunk_daily_note(content, source):
                 sub_chunk.page_content = f"{context_str}\n---\n{sub_chunk.page_content}"
                 sub_chunk.metadata.update(doc.metadata)  # Giữ lại metadata heading
                 sub_chunk.metadata.update(base_metadata)
+                sub_chunk.metadata["section"] = section
                 final_docs.append(sub_chunk)
         else:
             # Nếu chunk nhỏ gọn rồi thì Inject luôn
             doc.page_content = f"{context_str}\n---\n{doc.page_content}"
             doc.metadata.update(base_metadata)
+            doc.metadata["section"] = section
             final_docs.append(doc)
 
-    return final_docs
+    return final_docs, parent_texts
+
+
+def is_fence_close(line, fence):
+    """Dòng đóng fence: chỉ gồm ký tự fence, dài ít nhất bằng fence mở, không có info string (```python)."""
+    stripped = line.strip()
+    return len(stripped) >= len(fence) and stripped == fence[0] * len(stripped)
+
+
+def split_sections(content):
+    """
+    Cắt note thành các section theo heading (#, ##, ###). Phần trước heading đầu tiên là section 0.
+    Dòng `# ...` nằm trong code fence (comment bash/python) không tính là heading.
+    """
+    starts = [0]
+    fence = None
+    offset = 0
+    for line in content.splitlines(keepends=True):
+        match = CODE_FENCE_PATTERN.match(line)
+        if fence:
+            if is_fence_close(line, fence):
+                fence = None
+        elif match:
+            fence = match.group(1)
+        elif offset > 0 and SECTION_HEADER_PATTERN.match(line):
+            starts.append(offset)
+        offset += len(line)
+
+    bounds = starts + [len(content)]
+    sections = [content[bounds[i] : bounds[i + 1]].strip() for i in range(len(starts))]
+    return [section for section in sections if section]
 
 
 def chunk_topic_note(content, source):
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=1000, chunk_overlap=200, separators=["\n## ", "\n### ", "\n", " "]
     )
-    docs = text_splitter.create_documents([content], metadatas=[{"source": source, "type": "deep_work"}])
-    return docs
 
+    # Cắt theo section trước để chunk không bao giờ vắt qua 2 section (section cha luôn chứa trọn chunk)
+    parent_texts = split_sections(content)
+    docs = []
+    for section, text in enumerate(parent_texts):
+        section_docs = text_splitter.create_documents(
+            [text], metadatas=[{"source": source, "type": "deep_work", "section": section}]
+        )
+        docs.extend(section_docs)
+
+    return docs, parent_texts
 
-def process_notes():
+
+def process_notes(profiler=None):
+    profiler = profiler or Profiler("enrich")
     print(f"🔌 Kết nối não bộ: {LOCAL_MODEL_NAME}")
     print(f"📂 Quét folder: {NOTES_DIRECTORY}")
 
-    embedding_function = OllamaEmbeddings(model=EMBEDDING_MODEL_NAME)
-    vectorstore = Chroma(
-        persist_directory=VECTOR_DB_PATH, embedding_function=embedding_function, collection_name=COLLECTION_NAME
-    )
+    with profiler.stage("init_db"):
+        embedding_function = OllamaEmbeddings(model=EMBEDDING_MODEL_NAME)
+        vectorstore = Chroma(
+            persist_directory=VECTOR_DB_PATH, embedding_function=embedding_function, collection_name=COLLECTION_NAME
+        )
+        chunk_index = load_index()
 
     updated = 0
     skipped = 0
+    # File đã vào DB nhưng chưa đóng dấu hash. Index là 1 file JSON nên ghi theo lô chứ không ghi mỗi file,
+    # hash chỉ đóng dấu sau khi index đã xuống đĩa: bị kill giữa lô thì lần sau các file đó chạy lại
+    pending = []
+
+    def flush_pending():
+        if not pending:
+            return
+        with profiler.stage("save_index"):
+            save_index(chunk_index)
+        for file_path, content, ai_meta, current_hash in pending:
+            try:
+                update_file_with_metadata(file_path, content, ai_meta, current_hash)
+            except Exception as e:
+                print(f"❌ Lỗi ghi metadata {file_path}: {e}")
+        pending.clear()
 
-    for root, dirs, files in os.walk(NOTES_DIRECTORY):
-        dirs[:] = [d for d in dirs if not d.startswith(".")]
-
-        for file in files:
-            if file.endswith(".md"):
-                file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, encoding="utf-8") as f:
-                        content = f.read()
-
-                    clean_content = METADATA_PATTERN.sub("", content).strip()
-                    current_hash = calculate_file_hash(clean_content)
-
-                    existing_meta = get_existing_metadata(content)
-                    old_hash = extract_hash_from_metadata(existing_meta)
-
-                    if old_hash == current_hash:
-                        print(f"⏩ Skip: {file}")
-                        skipped += 1
-                        continue
-
-                    print(f"🔄 Processing: {file}...")
-
-                    # 1. Sinh Metadata
-                    ai_meta = generate_ai_metadata(clean_content, file)
-                    update_file_with_metadata(file_path, content, ai_meta, current_hash)
-
-                    # 2. CHUNKING (Gọi hàm đã update)
-                    chunks = []
-                    is_daily = False
-
-                    if DAILY_NOTE_PATTERN.match(file):
-                        chunks = chunk_daily_note(clean_content, file_path)
-                        is_daily = True
-                    else:
-                        chunks = chunk_topic_note(clean_content, file_path)
+    try:
+        for root, dirs, files in os.walk(NOTES_DIRECTORY):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+
+            for file in files:
+                if file.endswith(".md"):
+                    file_path = os.path.join(root, file)
+                    try:
+                        with profiler.stage("read_file"):
+                            with open(file_path, encoding="utf-8") as f:
+                                content = f.read()
+
+                        # Regex chạy trong C không để lại frame Python nên tách stage riêng mới đo được
+                        with profiler.stage("regex_strip"):
+                            clean_content = METADATA_PATTERN.sub("", content).strip()
+                            existing_meta = get_existing_metadata(content)
+                            old_hash = extract_hash_from_metadata(existing_meta)
+
+                        with profiler.stage("hash"):
+                            current_hash = calculate_file_hash(clean_content)
+
+                        # Hash khớp nhưng index chưa có file (index mất/hỏng, bị kill giữa lô) thì vẫn phải chunk lại
+                        if old_hash == current_hash and file_path in chunk_index["sources"]:
+                            print(f"⏩ Skip: {file}")
+                            skipped += 1
+                            continue
+
+                        print(f"🔄 Processing: {file}...")
+
+                        # 1. Sinh Metadata (nội dung không đổi thì dùng lại metadata cũ, khỏi gọi LLM)
+                        if old_hash == current_hash:
+                            ai_meta = re.sub(r"Content-Hash:\s*[a-f0-9]+\s*", "", existing_meta, count=1)
+                        else:
+                            with profiler.stage("ai_metadata"):
+                                ai_meta = generate_ai_metadata(clean_content, file)
+
+                        # 2. CHUNKING (Gọi hàm đã update)
+                        chunks = []
+                        parent_texts = []
                         is_daily = False
 
-                    # 3. Context Injection (Cho luồng Topic)
-                    # (Luồng Daily đã inject bên trong hàm chunk_daily_note rồi)
-                    file_name_only = os.path.basename(file_path)
-                    keywords = "General"
-                    if "Keywords:" in ai_meta:
-                        try:
-                            keywords = ai_meta.split("Keywords:")[1].strip().split("\n")[0]
-                        except:
-                            pass
-
-                    if not is_daily:
-                        for chunk in chunks:
-                            chunk.metadata["original_content"] = chunk.page_content
-                            chunk.metadata["ai_summary"] = ai_meta
-                            chunk.page_content = f"SOURCE DOCUMENT: {file_name_only}\nCONTEXT KEYWORDS: {keywords}\n---\n{chunk.page_content}"
-
-                    # 4. Đẩy vào DB
-                    if chunks:
-                        vectorstore.add_documents(chunks)
-                        updated += 1
-
-                except Exception as e:
-                    print(f"❌ Lỗi file {file}: {e}")
+                        chunk_start = time.perf_counter()
+                        with profiler.stage("chunking"):
+                            if DAILY_NOTE_PATTERN.match(file):
+                                chunks, parent_texts = chunk_daily_note(clean_content, file_path)
+                                is_daily = True
+                            else:
+                                chunks, parent_texts = chunk_topic_note(clean_content, file_path)
+                                is_daily = False
+                        profiler.add_row(
+                            "chunking",
+                            file=file_path,
+                            type="daily_log" if is_daily else "deep_work",
+                            bytes=len(clean_content.encode("utf-8")),
+                            chunks=len(chunks),
+                            ms=round((time.perf_counter() - chunk_start) * 1000, 2),
+                        )
+
+                        # 3. Context Injection (Cho luồng Topic)
+                        # (Luồng Daily đã inject bên trong hàm chunk_daily_note rồi)
+                        file_name_only = os.path.basename(file_path)
+                        keywords = "General"
+                        if "Keywords:" in ai_meta:
+                            try:
+                                keywords = ai_meta.split("Keywords:")[1].strip().split("\n")[0]
+                            except:
+                                pass
+
+                        if not is_daily:
+                            for chunk in chunks:
+                                chunk.metadata["original_content"] = chunk.page_content
+                                chunk.metadata["ai_summary"] = ai_meta
+                                chunk.page_content = f"SOURCE DOCUMENT: {file_name_only}\nCONTEXT KEYWORDS: {keywords}\n---\n{chunk.page_content}"
+                            parent_texts = [
+                                f"SOURCE DOCUMENT: {file_name_only}\nCONTEXT KEYWORDS: {keywords}\n---\n{text}"
+                                for text in parent_texts
+                            ]
+
+                        with profiler.stage("embed_store"):
+                            # 4. Ghi index chunk -> section cha/hàng xóm, id ổn định theo file nên add lại là ghi đè
+                            # Xóa chunk cũ theo source chứ không theo id trong index: index có thể thiếu/cũ hơn DB
+                            index_source(chunk_index, file_path, chunks, parent_texts)
+                            vectorstore.delete(where={"source": file_path})
+
+                            # 5. Đẩy vào DB
+                            if chunks:
+                                vectorstore.add_documents(chunks, ids=[chunk.metadata["chunk_id"] for chunk in chunks])
+                                updated += 1
+
+                        # 6. Đóng dấu hash theo lô, sau khi index đã ghi xuống đĩa
+                        pending.append((file_path, content, ai_meta, current_hash))
+                        if len(pending) >= INDEX_SAVE_EVERY:
+                            flush_pending()
+
+                    except Exception as e:
+                        print(f"❌ Lỗi file {file}: {e}")
+    finally:
+        flush_pending()
 
     print("-" * 30)
     print(f"🎉 Xong! Updated: {updated} | Skipped: {skipped}")
 
 
 if __name__ == "__main__":
-    process_notes()
+    parser = argparse.ArgumentParser(description="Enrich metadata + build vector DB từ notes.")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    profiler = Profiler("enrich", mode=args.profile)
+    profiler.start()
+    try:
+        process_notes(profiler)
+    finally:
+        profiler.dump()
@@ -1,5 +1,7 @@
+import argparse
 import os
 import sys
+import time
 import warnings
 
 from langchain_chroma import Chroma
@@ -12,6 +14,8 @@ from langchain_core.runnables import RunnablePassthrough
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_ollama import ChatOllama, OllamaEmbeddings
 
+from chunk_index import expand_docs, load_index
+
 # Config an toàn
 from config import (
     CLOUD_MODEL_NAME,
@@ -20,14 +24,25 @@ from config import (
     GOOGLE_API_KEY,
     LOCAL_MODEL_NAME,
     POLY_SYSTEM_PROMPT,
+    RERANK_TOP_N,
+    RETRIEVE_K,
     VECTOR_DB_PATH,
 )
+from profiler import Profiler, add_profile_argument
 
 warnings.filterwarnings("ignore")
 
 
-def format_docs(docs):
-    return "\n\n".join(doc.page_content for doc in docs)
+def format_docs(docs, chunk_index=None, vectorstore=None):
+    """Ghép context cho prompt. Có chunk index thì mở rộng chunk nhỏ ra section cha (small-to-big)."""
+    if not chunk_index:
+        return "\n\n".join(doc.page_content for doc in docs)
+
+    def fetch_chunks(ids):
+        result = vectorstore.get(ids=ids)
+        return dict(zip(result["ids"], result["documents"]))
+
+    return "\n\n".join(expand_docs(docs, chunk_index, fetch_chunks if vectorstore else None))
 
 
 # --- HÀM KHỞI TẠO NÃO BỘ (HYBRID) ---
@@ -53,7 +68,8 @@ def get_llm(force_local=False):
     return llm, "LOCAL"
 
 
-def main():
+def main(profiler=None):
+    profiler = profiler or Profiler("main")
     if not os.path.exists(VECTOR_DB_PATH):
         print(f"❌ Không tìm thấy Database tại {VECTOR_DB_PATH}!")
         return
@@ -62,26 +78,37 @@ def main():
 
     try:
         # Vẫn dùng Local Embedding cho nhanh & rẻ
-        embedding_function = OllamaEmbeddings(model=EMBEDDING_MODEL_NAME)
-        vectorstore = Chroma(
-            persist_directory=VECTOR_DB_PATH, embedding_function=embedding_function, collection_name=COLLECTION_NAME
-        )
+        with profiler.stage("load_db"):
+            embedding_function = OllamaEmbeddings(model=EMBEDDING_MODEL_NAME)
+            vectorstore = Chroma(
+                persist_directory=VECTOR_DB_PATH, embedding_function=embedding_function, collection_name=COLLECTION_NAME
+            )
     except Exception as e:
         print(f"💀 Lỗi load DB: {e}")
         return
 
-    retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": 30})
+    # Retrieve + rerank trên chunk nhỏ, chỉ chunk thắng mới được mở rộng ra section cha
+    retriever = vectorstore.as_retriever(search_type="similarity", search_kwargs={"k": RETRIEVE_K})
+    chunk_index = load_index()
+    unindexed = [chunk_id for chunk_id in vectorstore.get(include=[])["ids"] if chunk_id not in chunk_index["lookup"]]
+    if unindexed:
+        print(
+            f"⚠️  {len(unindexed)} chunk trong DB chưa có trong chunk index (DB cũ?), các chunk này dùng chunk trần."
+            " Chạy lại enrich.py để bổ sung."
+        )
 
     print("🧠 Đang tải Reranker (CPU Mode)...")
     try:
-        model_kwargs = {"device": "cpu"}
-        reranker = HuggingFaceCrossEncoder(model_name="BAAI/bge-reranker-base", model_kwargs=model_kwargs)
+        with profiler.stage("load_reranker"):
+            model_kwargs = {"device": "cpu"}
+            reranker = HuggingFaceCrossEncoder(model_name="BAAI/bge-reranker-base", model_kwargs=model_kwargs)
         print("✅ Reranker đã sẵn sàng.")
     except Exception:
         reranker = None
 
     # Khởi tạo não bộ lần đầu
-    llm, mode = get_llm()
+    with profiler.stage("init_llm"):
+        llm, mode = get_llm()
     prompt = ChatPromptTemplate.from_template(POLY_SYSTEM_PROMPT)
 
     print("\n" + "=" * 40)
@@ -107,29 +134,32 @@ def main():
                 continue
 
             print(f"\n🔍 Đang bới thùng rác tìm: '{query}'...")
+            query_start = time.perf_counter()
 
             # --- RAG RETRIEVAL ---
-            retrieved_docs = retriever.invoke(query)
+            with profiler.stage("retrieve"):
+                retrieved_docs = retriever.invoke(query)
             final_docs = []
 
             # Rerank Logic
             if reranker:
                 try:
                     pairs = [[query, doc.page_content] for doc in retrieved_docs]
-                    scores = reranker.score(pairs)
+                    with profiler.stage("rerank"):
+                        scores = reranker.score(pairs)
                     scored_docs = sorted(zip(retrieved_docs, scores), key=lambda x: x[1], reverse=True)
 
                     # Threshold lọc nhẹ (-10.0 là lấy gần hết để AI tự lọc)
-                    for doc, score in scored_docs[:7]:
+                    for doc, score in scored_docs[:RERANK_TOP_N]:
                         if score > -10.0:
                             final_docs.append(doc)
 
                     if not final_docs and scored_docs:
                         final_docs = [scored_docs[0][0]]
                 except:
-                    final_docs = retrieved_docs[:5]
+                    final_docs = retrieved_docs[:RERANK_TOP_N]
             else:
-                final_docs = retrieved_docs[:5]
+                final_docs = retrieved_docs[:RERANK_TOP_N]
 
             if not final_docs:
                 print("\n🤖 Polymath Bot:")
@@ -137,7 +167,8 @@ def main():
                 print("Tao chịu. Không tìm thấy thông tin nào khớp cả.")
                 continue
 
-            context_text = format_docs(final_docs)
+            with profiler.stage("expand_context"):
+                context_text = format_docs(final_docs, chunk_index, vectorstore)
             chain = prompt | llm | StrOutputParser()
 
             print(f"\n🤖 Polymath Bot ({mode}):")
@@ -145,8 +176,9 @@ def main():
 
             # --- TRY/EXCEPT CHO LLM CALL (FALLBACK LOGIC) ---
             try:
-                for chunk in chain.stream({"context": context_text, "question": query}):
-                    print(chunk, end="", flush=True)
+                with profiler.stage("llm_stream"):
+                    for chunk in chain.stream({"context": context_text, "question": query}):
+                        print(chunk, end="", flush=True)
             except Exception as e:
                 print(f"\n\n⚠️  Lỗi khi gọi {mode}: {e}")
                 if mode == "CLOUD":
@@ -154,12 +186,21 @@ def main():
                     llm, mode = get_llm(force_local=True)  # Switch to Local
                     # Retry ngay lập tức với Local LLM
                     chain = prompt | llm | StrOutputParser()
-                    for chunk in chain.stream({"context": context_text, "question": query}):
-                        print(chunk, end="", flush=True)
+                    with profiler.stage("llm_stream"):
+                        for chunk in chain.stream({"context": context_text, "question": query}):
+                            print(chunk, end="", flush=True)
                 else:
                     print("💀 Local cũng chết. Mày check lại Ollama đi.")
 
             print("\n" + "-" * 30)
+            profiler.add_row(
+                "queries",
+                query=query,
+                retrieved=len(retrieved_docs),
+                used=len(final_docs),
+                context_chars=len(context_text),
+                ms=round((time.perf_counter() - query_start) * 1000, 2),
+            )
 
             # Evidence
             print("📚 Nguồn dữ liệu (Evidence):")
@@ -179,4 +220,13 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Polymath Bro - RAG chat trên Second Brain.")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    profiler = Profiler("main", mode=args.profile)
+    profiler.start()
+    try:
+        main(profiler)
+    finally:
+        profiler.dump()
@@ -1,13 +1,55 @@
+import argparse
+import hashlib
+import json
 import os
+import re
+import secrets
+import signal
+import stat
 import subprocess
 import sys
 import tempfile
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
 
-import markdown  # Khai báo nhưng không dùng, chỉ dùng MathJax CDN
+import markdown
 
 # Lệnh này dùng để mở trình duyệt mặc định trên Linux (Fedora)
 OPEN_CMD = "xdg-open"
 
+# --- PREVIEW SERVER CONFIG ---
+# Server sống lâu trên localhost, mỗi lần :MathPreview chỉ báo cho server đổi file chứ không mở tab mới
+PREVIEW_HOST = "127.0.0.1"
+PREVIEW_PORT = int(os.getenv("MD_PREVIEW_PORT", "8765"))
+WATCH_INTERVAL = 0.3  # Giây giữa 2 lần check mtime file
+BLOCK_CACHE_SIZE = 2048  # Số block HTML đã render được giữ lại trong cache
+# Chỉ chấp nhận request gửi tới chính server (chống DNS rebinding / trang web lạ gọi vào localhost)
+ALLOWED_HOSTS = {f"{PREVIEW_HOST}:{PREVIEW_PORT}", f"localhost:{PREVIEW_PORT}"}
+# Token sinh lúc start, ghi vào folder riêng của user (0700); /open và /update bắt buộc gửi kèm header này
+TOKEN_HEADER = "X-Preview-Token"
+TOKEN_FILE_NAME = f"md_preview_{PREVIEW_PORT}.token"
+
+MARKDOWN_EXTENSIONS = ["fenced_code", "tables", "sane_lists", "nl2br"]
+
+FENCE_PATTERN = re.compile(r"^\s*(```+|~~~+)")
+# Block math $$ chỉ khi $$ đứng riêng một dòng, hoặc cả dòng là đúng một cặp $$...$$
+MATH_BLOCK_LINE_PATTERN = re.compile(r"^\$\$(?:(?!\$\$).)+\$\$$")
+LIST_ITEM_PATTERN = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s")
+REFERENCE_PATTERN = re.compile(r"^ {0,3}\[[^\]]+\]:\s*\S")
+# Inline code đứng trước để công thức nằm trong `...` không bị tưởng nhầm là math
+MATH_PATTERN = re.compile(
+    r"(`+)(?:.+?)\1"
+    r"|\$\$.+?\$\$"
+    r"|\\\[.+?\\\]"
+    r"|\\\(.+?\\\)"
+    r"|(?<![\\$])\$(?!\s)[^$\n]+?(?<![\s\\])\$(?!\d)",
+    re.DOTALL,
+)
+
 # Template HTML cơ bản, chèn MathJax và nội dung Markdown
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -16,76 +58,553 @@ HTML_TEMPLATE = """
     <title>Math Preview</title>
     <meta charset="utf-8">
     <meta name="viewport" content="width=device-width, initial-scale=1">
-    
+
     <!-- Tailwind CSS cho giao diện đẹp và đọc dễ hơn -->
     <script src="https://cdn.tailwindcss.com"></script>
     <link rel="preconnect" href="https://fonts.googleapis.com">
     <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;600&display=swap" rel="stylesheet">
-    
+
     <!-- Script MathJax để render LaTeX Math -->
     <script>
-      MathJax = {{
-        tex: {{
-          inlineMath: [['$', '$'], ['\\(', '\\)']],
-          displayMath: [['$$', '$$'], ['\\[', '\\]']],
-          packages: ['base', 'ams']
-        }}
-      }};
+      MathJax = {
+        tex: {
+          inlineMath: [['$', '$'], ['\\\\(', '\\\\)']],
+          displayMath: [['$$', '$$'], ['\\\\[', '\\\\]']],
+          packages: {'[+]': ['ams']}
+        }
+      };
     </script>
     <script id="MathJax-script" async src="https://cdn.jsdelivr.net/npm/mathjax@3/es5/tex-mml-chtml.js"></script>
 
     <style>
-        body {{ font-family: 'Inter', sans-serif; }}
+        body { font-family: 'Inter', sans-serif; }
         /* Tùy chỉnh màu sắc Markdown cho chế độ đọc ban đêm */
-        pre {{ background-color: #2d3748; padding: 1rem; border-radius: 0.5rem; overflow-x: auto; }}
-        img {{ max-width: 100%; height: auto; border-radius: 0.5rem; }}
-        h1, h2, h3 {{ border-bottom: 1px solid #4a5568; padding-bottom: 0.3rem; margin-top: 2rem; }}
-        table {{ width: 100%; border-collapse: collapse; margin: 1rem 0; }}
-        th, td {{ border: 1px solid #4a5568; padding: 0.75rem; text-align: left; }}
+        pre { background-color: #2d3748; padding: 1rem; border-radius: 0.5rem; overflow-x: auto; }
+        img { max-width: 100%; height: auto; border-radius: 0.5rem; }
+        h1, h2, h3 { border-bottom: 1px solid #4a5568; padding-bottom: 0.3rem; margin-top: 2rem; }
+        table { width: 100%; border-collapse: collapse; margin: 1rem 0; }
+        th, td { border: 1px solid #4a5568; padding: 0.75rem; text-align: left; }
     </style>
 </head>
 <body class="bg-gray-900 text-gray-200 min-h-screen p-8">
     <div class="max-w-4xl mx-auto p-6 bg-gray-800 rounded-xl shadow-2xl">
-        <h1 class="text-3xl font-bold mb-4 text-indigo-400">📝 Live Markdown Preview</h1>
+        <h1 id="title" class="text-3xl font-bold mb-4 text-indigo-400">📝 Live Markdown Preview</h1>
         <!-- Content placeholder -->
         <div id="content" class="prose max-w-none">
             {content_placeholder}
         </div>
     </div>
+    {live_script}
 </body>
 </html>
 """
 
+# Client chỉ nhận HTML của block mới, block cũ thì tái sử dụng DOM node theo hash
+LIVE_SCRIPT = """
+<script>
+  const content = document.getElementById("content");
+  const title = document.getElementById("title");
+  let nodes = new Map();
+  const source = new EventSource("/events");
+  source.onmessage = (event) => {
+    const msg = JSON.parse(event.data);
+    if (msg.title) title.textContent = "📝 " + msg.title;
+    if (msg.reset) nodes = new Map();
+    const next = new Map();
+    const fresh = [];
+    const fragment = document.createDocumentFragment();
+    for (const [key, html] of msg.blocks) {
+      const known = nodes.get(key) || next.get(key);
+      if (html === null && !known) {
+        // Lệch trạng thái với server: load lại page, stream mới sẽ gửi full (reset)
+        source.close();
+        location.reload();
+        return;
+      }
+      let node = known;
+      if (!known || next.has(key)) {
+        node = document.createElement("div");
+        node.innerHTML = html !== null ? html : known.innerHTML;
+        fresh.push(node);
+      }
+      next.set(key, node);
+      fragment.appendChild(node);
+    }
+    content.replaceChildren(fragment);
+    nodes = next;
+    if (fresh.length && window.MathJax && MathJax.typesetPromise) {
+      MathJax.typesetPromise(fresh);
+    }
+  };
+</script>
+"""
+
+
+# --- RENDERING (CÓ CACHE THEO HASH) ---
+
+_block_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def block_hash(text):
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+def is_fence_close(line, fence):
+    """Dòng đóng fence: chỉ gồm ký tự fence, dài ít nhất bằng fence mở, không có info string (```python)."""
+    stripped = line.strip()
+    return len(stripped) >= len(fence) and stripped == fence[0] * len(stripped)
+
+
+def split_blocks(md_content):
+    """
+    Cắt Markdown thành các block độc lập (đoạn văn, code fence, math $$...$$).
+    Code fence và block math được giữ nguyên kể cả khi có dòng trống bên trong.
+    Dòng trống chỉ cắt block khi dòng sau không thụt lề và không nối tiếp một list,
+    để đoạn con của list item / code thụt lề không bị tách ra render sai.
+    """
+    blocks = []
+    current = []
+    fence = None
+    in_math = False
+    in_list = False
+    pending_blank = False
+
+    def flush():
+        nonlocal in_list
+        if current:
+            blocks.append("\n".join(current))
+            current.clear()
+        in_list = False
+
+    for line in md_content.splitlines():
+        stripped = line.strip()
+
+        if fence:
+            current.append(line)
+            if is_fence_close(line, fence):
+                fence = None
+                flush()
+            continue
+
+        if in_math:
+            current.append(line)
+            if stripped.endswith("$$"):
+                in_math = False
+                flush()
+            continue
+
+        if not stripped:
+            pending_blank = True
+            continue
+
+        if pending_blank:
+            pending_blank = False
+            indented = line[:1] in (" ", "\t")
+            if current and (indented or (in_list and LIST_ITEM_PATTERN.match(line))):
+                current.append("")
+            else:
+                flush()
+
+        match = FENCE_PATTERN.match(line)
+        if match and not (in_list and line[:1] in (" ", "\t")):
+            flush()
+            fence = match.group(1)
+            current.append(line)
+            continue
+
+        # `$$x$$.` hay `$$ a $$ chữ` là math inline trong đoạn văn, không phải block
+        if (stripped == "$$" or MATH_BLOCK_LINE_PATTERN.match(stripped)) and not in_list:
+            flush()
+            current.append(line)
+            if stripped == "$$":
+                in_math = True
+            else:
+                flush()
+            continue
+
+        if not current and LIST_ITEM_PATTERN.match(line):
+            in_list = True
+        current.append(line)
+
+    flush()
+    return blocks
 
-def generate_html_content(md_content):
+
+def extract_references(md_content):
+    """Gom các định nghĩa link tham chiếu `[id]: url` của cả file để block nào cũng resolve được."""
+    refs = []
+    fence = None
+    for line in md_content.splitlines():
+        match = FENCE_PATTERN.match(line)
+        if fence:
+            if is_fence_close(line, fence):
+                fence = None
+        elif match:
+            fence = match.group(1)
+        elif REFERENCE_PATTERN.match(line):
+            refs.append(line.strip())
+    return "\n".join(refs)
+
+
+def protect_math(text):
+    """Thay công thức bằng placeholder để Markdown parser không escape/nuốt mất `_`, `*`, `\\`."""
+    stash = []
+
+    def repl(match):
+        if match.group(1):  # Inline code thì để nguyên cho parser xử lý
+            return match.group(0)
+        stash.append(match.group(0))
+        return f"MATHSTASH{len(stash) - 1}X"
+
+    return MATH_PATTERN.sub(repl, text), stash
+
+
+def restore_math(html, stash):
+    for i, formula in enumerate(stash):
+        escaped = formula.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+        html = html.replace(f"MATHSTASH{i}X", escaped)
+    return html
+
+
+def render_block(text, refs=""):
+    """Render một block Markdown sang HTML, có cache theo content hash (tính cả refs block dùng tới)."""
+    # Chỉ block có `[` mới cần refs, block khác giữ nguyên key khi refs đổi
+    refs = refs if refs and "[" in text and not FENCE_PATTERN.match(text) else ""
+    key = block_hash(f"{text}\0{refs}" if refs else text)
+    with _cache_lock:
+        if key in _block_cache:
+            _block_cache.move_to_end(key)
+            return key, _block_cache[key]
+
+    if FENCE_PATTERN.match(text):
+        html = markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS)
+    else:
+        protected, stash = protect_math(f"{text}\n\n{refs}" if refs else text)
+        html = restore_math(markdown.markdown(protected, extensions=MARKDOWN_EXTENSIONS), stash)
+
+    with _cache_lock:
+        _block_cache[key] = html
+        if len(_block_cache) > BLOCK_CACHE_SIZE:
+            _block_cache.popitem(last=False)
+    return key, html
+
+
+def render_blocks(md_content):
+    """Trả về list (hash, html) theo thứ tự block trong file."""
+    refs = extract_references(md_content)
+    return [render_block(block, refs) for block in split_blocks(md_content)]
+
+
+def generate_html_content(md_content, live=False):
     """
     Chuyển Markdown sang HTML và thay thế nội dung trong template.
-    Vì không dùng thư viện Markdown parser, ta chỉ cần wrap nội dung và MathJax sẽ lo phần công thức.
+    Ở chế độ live, nội dung được server đẩy xuống qua EventSource nên placeholder để trống.
     """
-    # Thay thế các ký tự đặc biệt để HTML không bị lỗi
-    html_content = md_content.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;")
+    if live:
+        body = ""
+    else:
+        body = "\n".join(f"<div>{html}</div>" for _, html in render_blocks(md_content))
+    return HTML_TEMPLATE.replace("{content_placeholder}", body).replace("{live_script}", LIVE_SCRIPT if live else "")
 
-    # Simple formatting: chuyển đổi tiêu đề và đoạn văn bản thô sơ
-    html_content = html_content.replace("\n# ", "<h1>").replace("\n## ", "<h2>").replace("\n### ", "<h3>")
-    html_content = html_content.replace("\n", "<p>")
 
-    # Bảo toàn code blocks, nếu có
-    # (Việc render Markdown phức tạp hơn cần thư viện, nhưng MathJax vẫn hoạt động tốt trên nền thô)
+# --- PREVIEW SERVER ---
 
-    return HTML_TEMPLATE.replace("{content_placeholder}", html_content)
 
+class PreviewState:
+    """Giữ file đang preview và phiên bản render mới nhất, đánh thức các client khi có thay đổi."""
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: md_preview.py <path/to/markdown/file>")
-        sys.exit(1)
+    def __init__(self, path):
+        self.lock = threading.Condition()
+        self.path = None
+        self.mtime = None
+        self.content_hash = None
+        self.blocks = []
+        self.version = 0
+        self.generation = 0  # Tăng khi đổi file để client bỏ cache DOM cũ
+        self.clients = 0  # Số tab đang mở stream /events
+        self.set_path(path)
 
-    md_file_path = sys.argv[1]
+    def set_path(self, path):
+        with self.lock:
+            self.path = os.path.abspath(path)
+            self.mtime = None
+            self.content_hash = None
+            self.generation += 1
+        self.refresh()
 
-    if not os.path.exists(md_file_path):
-        print(f"❌ File không tồn tại: {md_file_path}")
+    def refresh(self, content=None):
+        """Đọc lại file (hoặc dùng content được đẩy từ nvim) và render nếu nội dung thay đổi."""
+        # Đọc file/render nằm ngoài lock, nên nếu set_path đổi file giữa chừng (generation đổi) thì bỏ kết quả,
+        # không ghi đè nội dung file cũ lên file mới
+        with self.lock:
+            path, generation, old_mtime = self.path, self.generation, self.mtime
+        if content is None:
+            try:
+                mtime = os.path.getmtime(path)
+                if mtime == old_mtime:
+                    return False
+                with open(path, encoding="utf-8") as f:
+                    content = f.read()
+            except OSError as e:
+                print(f"⚠️  Không đọc được {path}: {e}")
+                return False
+        else:
+            mtime = old_mtime
+
+        new_hash = block_hash(content)
+        with self.lock:
+            if generation != self.generation:
+                return False
+            self.mtime = mtime
+            if new_hash == self.content_hash:
+                return False
+
+        blocks = render_blocks(content)
+        with self.lock:
+            if generation != self.generation:
+                return False
+            self.content_hash = new_hash
+            self.blocks = blocks
+            self.version += 1
+            self.lock.notify_all()
+        return True
+
+    def wait_for_change(self, version, timeout=15):
+        with self.lock:
+            if self.version == version:
+                self.lock.wait(timeout)
+            return self.version, self.generation, os.path.basename(self.path), list(self.blocks)
+
+
+def watch_file(state, stop_event):
+    while not stop_event.is_set():
+        state.refresh()
+        stop_event.wait(WATCH_INTERVAL)
+
+
+def make_handler(state, token):
+    class PreviewHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass  # Im lặng, không spam terminal của nvim
+
+        def _allowed(self, need_token=False):
+            """Host/Origin phải là chính server; request ghi (đổi file, đẩy nội dung) cần thêm token."""
+            ok = self.headers.get("Host") in ALLOWED_HOSTS
+            origin = self.headers.get("Origin")
+            if origin is not None:
+                ok = ok and origin.removeprefix("http://") in ALLOWED_HOSTS
+            if need_token:
+                ok = ok and secrets.compare_digest(self.headers.get(TOKEN_HEADER, ""), token)
+            if not ok:
+                self._send(403, "forbidden")
+            return ok
+
+        def _send(self, code, body, content_type="text/plain; charset=utf-8"):
+            data = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if not self._allowed():
+                return
+            url = urlparse(self.path)
+            if url.path == "/":
+                self._send(200, generate_html_content("", live=True), "text/html; charset=utf-8")
+            elif url.path == "/events":
+                self._stream_events()
+            elif url.path == "/ping":
+                with state.lock:
+                    clients = state.clients
+                self._send(200, json.dumps({"app": "md_preview", "clients": clients}), "application/json")
+            else:
+                self._send(404, "not found")
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            if path not in ("/open", "/update"):
+                self._send(404, "not found")
+                return
+            if not self._allowed(need_token=True):
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length).decode("utf-8")
+
+            if path == "/open":
+                if not os.path.exists(body):
+                    self._send(404, f"File không tồn tại: {body}")
+                    return
+                state.set_path(body)
+            else:
+                # Cho phép nvim đẩy nội dung buffer chưa save lên để preview theo từng phím gõ
+                state.refresh(content=body)
+            self._send(200, "ok")
+
+        def _stream_events(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+
+            sent = set()  # Hash các block page đang giữ = đúng các block của message gửi gần nhất
+            version = -1
+            generation = None
+            with state.lock:
+                state.clients += 1
+            try:
+                while True:
+                    new_version, new_generation, title, blocks = state.wait_for_change(version)
+                    if new_version == version:
+                        self.wfile.write(b": keepalive\n\n")
+                        self.wfile.flush()
+                        continue
+
+                    reset = new_generation != generation
+                    if reset:
+                        sent.clear()
+                    # Page chỉ giữ block của message mới nhất nên block bị xóa rồi undo phải gửi lại HTML
+                    payload = [[key, None if key in sent else html] for key, html in blocks]
+                    sent = {key for key, _ in blocks}
+                    msg = json.dumps({"title": title, "reset": reset, "blocks": payload})
+                    self.wfile.write(f"data: {msg}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    version, generation = new_version, new_generation
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with state.lock:
+                    state.clients -= 1
+
+    return PreviewHandler
+
+
+def server_url(path=""):
+    return f"http://{PREVIEW_HOST}:{PREVIEW_PORT}{path}"
+
+
+def token_path():
+    """
+    Token nằm trong $XDG_RUNTIME_DIR, không có thì trong folder <tempdir>/md_preview-<uid> tự tạo mode 0700.
+    Folder phải thuộc user hiện tại và không ai khác đọc/ghi được, nếu không thì raise PermissionError.
+    """
+    folder = os.getenv("XDG_RUNTIME_DIR")
+    if not folder or not os.path.isdir(folder):
+        folder = os.path.join(tempfile.gettempdir(), f"md_preview-{os.getuid()}")
+        try:
+            os.mkdir(folder, 0o700)
+        except FileExistsError:
+            pass
+    info = os.lstat(folder)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(f"Folder token {folder} không thuộc user hiện tại hoặc không phải mode 0700")
+    return os.path.join(folder, TOKEN_FILE_NAME)
+
+
+def write_token(token):
+    path = token_path()
+    # Xóa file cũ rồi tạo mới bằng O_EXCL | O_NOFOLLOW: không ghi đè qua symlink hay file người khác tạo sẵn
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+
+
+def read_token():
+    """Trả về token của server đang chạy, None nếu không có hoặc file không phải của user hiện tại."""
+    try:
+        fd = os.open(token_path(), os.O_RDONLY | os.O_NOFOLLOW)
+        with os.fdopen(fd, encoding="utf-8") as f:
+            info = os.fstat(f.fileno())
+            if info.st_uid != os.getuid() or info.st_mode & 0o077:
+                return None
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def notify_running_server(md_file_path):
+    """
+    Nếu server đã chạy sẵn thì chỉ báo nó đổi file.
+    Trả về số tab đang kết nối (0 = user đã đóng tab), None nếu không có server.
+    """
+    token = read_token()
+    if not token:
+        return None
+    try:
+        with urllib.request.urlopen(server_url("/ping"), timeout=0.5) as resp:
+            info = json.loads(resp.read().decode("utf-8"))
+            if info.get("app") != "md_preview":
+                return None
+        req = urllib.request.Request(
+            server_url("/open"),
+            data=os.path.abspath(md_file_path).encode("utf-8"),
+            headers={TOKEN_HEADER: token},
+            method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=2) as resp:
+            return info["clients"] if resp.status == 200 else None
+    except (urllib.error.URLError, OSError, ValueError):
+        return None
+
+
+def open_browser(target):
+    try:
+        subprocess.Popen([OPEN_CMD, target], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return True
+    except FileNotFoundError:
+        print(f"❌ Lệnh '{OPEN_CMD}' không được tìm thấy. Đảm bảo bạn đang dùng Linux và có xdg-open.")
+        return False
+
+
+def serve(md_file_path):
+    clients = notify_running_server(md_file_path)
+    if clients is not None:
+        print(f"🔁 Server preview đang chạy, đã chuyển sang: {md_file_path}")
+        if clients == 0:
+            open_browser(server_url("/"))  # Tab preview đã bị đóng thì mở lại
+        return
+
+    state = PreviewState(md_file_path)
+    token = secrets.token_urlsafe(32)
+    try:
+        httpd = ThreadingHTTPServer((PREVIEW_HOST, PREVIEW_PORT), make_handler(state, token))
+    except OSError as e:
+        print(f"❌ Không mở được cổng {PREVIEW_PORT}: {e}")
+        sys.exit(1)
+    try:
+        write_token(token)
+    except OSError as e:
+        httpd.server_close()
+        print(f"❌ Không ghi được token cho server preview: {e}")
         sys.exit(1)
+    httpd.daemon_threads = True
+
+    stop_event = threading.Event()
+    threading.Thread(target=watch_file, args=(state, stop_event), daemon=True).start()
+
+    # nvim jobstop gửi SIGTERM: thoát qua SystemExit để finally dọn token
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    print(f"✅ Preview server tại {server_url('/')} (Ctrl+C để tắt)")
+    open_browser(server_url("/"))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Tắt preview server.")
+    finally:
+        stop_event.set()
+        httpd.server_close()
+        if read_token() == token:
+            os.remove(token_path())
 
+
+def write_static(md_file_path):
     # 1. Đọc nội dung Markdown
     with open(md_file_path, encoding="utf-8") as f:
         md_content = f.read()
@@ -93,19 +612,37 @@ def main():
     # 2. Tạo nội dung HTML
     html_output = generate_html_content(md_content)
 
-    # 3. Ghi vào file tạm thời
+    # 3. Ghi vào file tạm, mỗi file nguồn một file HTML riêng
     temp_dir = tempfile.gettempdir()
-    temp_html_path = os.path.join(temp_dir, "nvim_math_preview.html")
+    name_hash = block_hash(os.path.abspath(md_file_path))[:8]
+    temp_html_path = os.path.join(temp_dir, f"nvim_math_preview_{name_hash}.html")
 
     with open(temp_html_path, "w", encoding="utf-8") as f:
         f.write(html_output)
 
     # 4. Mở trình duyệt
-    try:
-        subprocess.run([OPEN_CMD, temp_html_path])
+    if open_browser(temp_html_path):
         print(f"✅ Đã mở preview trong trình duyệt. File tạm: {temp_html_path}")
-    except FileNotFoundError:
-        print(f"❌ Lệnh '{OPEN_CMD}' không được tìm thấy. Đảm bảo bạn đang dùng Linux và có xdg-open.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preview Markdown + LaTeX trên trình duyệt.")
+    parser.add_argument("file", help="path/to/markdown/file")
+    parser.add_argument(
+        "--static", action="store_true", help="Chỉ render ra file HTML tạm rồi mở, không chạy server live."
+    )
+    args = parser.parse_args()
+
+    md_file_path = args.file
+
+    if not os.path.exists(md_file_path):
+        print(f"❌ File không tồn tại: {md_file_path}")
+        sys.exit(1)
+
+    if args.static:
+        write_static(md_file_path)
+    else:
+        serve(md_file_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+import cProfile
+import csv
+import io
+import os
+import pstats
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from config import PROFILE_DIR, PROFILE_SAMPLE_INTERVAL, PROFILE_TOP_N
+
+# Phân loại mỗi sample theo cả stack để biết thời gian rơi vào đâu (regex, splitter, LangChain, mạng...)
+# Khớp theo tên package/module gốc (thư mục ngay sau site-packages hoặc stdlib), không khớp chuỗi con của path
+MODULE_AREAS = {
+    "socket": "network",
+    "ssl": "network",
+    "selectors": "network",
+    "http": "network",
+    "urllib": "network",
+    "urllib3": "network",
+    "httpx": "network",
+    "httpcore": "network",
+    "requests": "network",
+    "grpc": "network",
+    "aiohttp": "network",
+    "re": "regex",
+    "sre_compile": "regex",
+    "sre_parse": "regex",
+    "langchain_text_splitters": "text_splitters",
+    "chromadb": "chromadb",
+    "torch": "torch/models",
+    "transformers": "torch/models",
+    "sentence_transformers": "torch/models",
+}
+STDLIB_DIRS = {os.path.normpath(sysconfig.get_paths()[key]) for key in ("stdlib", "platstdlib")}
+# Stage mà phần việc chính là hàm C không để lại frame Python (vd. Pattern.sub) thì gán area theo tên stage
+STAGE_AREAS = {"regex_strip": "regex"}
+
+
+def module_root(filename):
+    """Trả về (loại, tên package gốc): ("lib", "httpx"), ("stdlib", "re"), ("app", None) hoặc ("other", None)."""
+    if filename.startswith("<"):
+        return "other", None
+    path = os.path.normpath(filename)
+    parts = path.split(os.sep)
+    for marker in ("site-packages", "dist-packages"):
+        if marker in parts:
+            i = len(parts) - 1 - parts[::-1].index(marker)
+            if i + 1 < len(parts):
+                return "lib", parts[i + 1].split(".")[0]
+    for stdlib in STDLIB_DIRS:
+        if path.startswith(stdlib + os.sep):
+            return "stdlib", path[len(stdlib) + 1 :].split(os.sep)[0].split(".")[0]
+    return "app", None
+
+
+def classify_frame(filename):
+    kind, root = module_root(filename)
+    if root in MODULE_AREAS:
+        return MODULE_AREAS[root]
+    if root and root.startswith("langchain"):
+        return "langchain"
+    if kind in ("lib", "other"):
+        return "other_libs"
+    return "app" if kind == "app" else None
+
+
+def classify_stack(filenames, stage):
+    """
+    filenames đi từ frame ngoài cùng (root) vào trong (leaf).
+    Lấy thư viện có tên gần leaf nhất (vd. langchain_chroma -> chromadb thì tính chromadb, -> httpx thì network),
+    riêng regex thì tính cho thư viện gần nhất bọc ngoài nó (re trong text_splitters vẫn là text_splitters).
+    Không có thư viện nào -> theo stage, hoặc app/other_libs theo frame lá.
+    """
+    areas = [classify_frame(name) for name in filenames]
+    named = [(i, area) for i, area in enumerate(areas) if area not in (None, "app", "other_libs")]
+    if named:
+        i, area = named[-1]
+        if area == "regex":
+            enclosing = [a for j, a in named if j < i and a != "regex"]
+            if enclosing:
+                return enclosing[-1]
+        return area
+    if stage in STAGE_AREAS:
+        return STAGE_AREAS[stage]
+    for area in reversed(areas):
+        if area is not None:
+            return area
+    return "app"
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+PROFILE_MODES = ("sample", "cprofile")
+
+
+class Profiler:
+    """
+    Profile theo từng stage:
+    - mode="sample": thread lấy mẫu stack của main thread -> collapsed stacks (stacks.collapsed) cho
+      flamegraph.pl / speedscope, kèm bảng top-N hàm nóng mỗi stage (self% = ở leaf, total% = có trong stack).
+    - mode="cprofile": chỉ chạy cProfile cho bảng top-N hàm nóng mỗi stage (<stage>.pstats + summary.txt).
+      Python >= 3.12 cProfile ghi mọi thread, nên ở mode này không bật sampler để bảng không đo chính profiler.
+    - Bảng phụ (vd. thống kê chunk theo file) ghi ra <table>.csv.
+    Khi mode=None mọi hàm đều là no-op để code gọi không cần if.
+    """
+
+    def __init__(self, name, mode=None, out_dir=PROFILE_DIR, interval=PROFILE_SAMPLE_INTERVAL):
+        self.name = name
+        self.mode = mode
+        self.enabled = mode is not None
+        self.use_cprofile = mode == "cprofile"
+        self.out_dir = out_dir
+        self.interval = interval
+        self.stage_profiles = {}
+        self.stage_times = defaultdict(float)
+        self.staged_time = 0.0  # Tổng thời gian trong stage ngoài cùng (không tính lúc idle)
+        self.stage_stack = []
+        self.samples = Counter()
+        self.areas = defaultdict(Counter)
+        self.self_counts = defaultdict(Counter)  # stage -> hàm ở leaf (self time)
+        self.total_counts = defaultdict(Counter)  # stage -> hàm có mặt trong stack (inclusive time)
+        self.tables = defaultdict(list)
+        self._stop = threading.Event()
+        self._thread = None
+        self._main_ident = threading.main_thread().ident
+        self._started = None
+
+    def start(self):
+        if not self.enabled or self._thread:
+            return
+        self._started = time.perf_counter()
+        if self.use_cprofile:
+            return
+        self._thread = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+        self._thread.start()
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            # Ngoài stage (vd. chat đang chờ input()) là thời gian chết, không lấy mẫu
+            stages = list(self.stage_stack)
+            if not stages:
+                continue
+            frame = sys._current_frames().get(self._main_ident)
+            if frame is None:
+                continue
+            stack = []
+            filenames = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                filenames.append(frame.f_code.co_filename)
+                frame = frame.f_back
+            # Stage (kể cả stage lồng) làm gốc của flamegraph
+            self.samples[";".join(stages + stack[::-1])] += 1
+            self.areas[stages[-1]][classify_stack(filenames[::-1], stages[-1])] += 1
+            self.self_counts[stages[-1]][stack[0]] += 1
+            self.total_counts[stages[-1]].update(set(stack))
+
+    @contextmanager
+    def stage(self, name):
+        """Đo một stage. Stage lồng nhau chỉ đổi nhãn sample, cProfile chỉ chạy ở stage ngoài cùng."""
+        if not self.enabled:
+            yield
+            return
+
+        outer = not self.stage_stack
+        profile = None
+        if outer and self.use_cprofile:
+            profile = self.stage_profiles.setdefault(name, cProfile.Profile())
+        self.stage_stack.append(name)
+        start = time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            elapsed = time.perf_counter() - start
+            self.stage_times[name] += elapsed
+            if outer:
+                self.staged_time += elapsed
+            self.stage_stack.pop()
+
+    def add_row(self, table, **fields):
+        if self.enabled:
+            self.tables[table].append(fields)
+
+    def dump(self):
+        """Ghi toàn bộ kết quả ra PROFILE_DIR/<name>-<timestamp>/ và trả về đường dẫn folder."""
+        if not self.enabled:
+            return None
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+        run_dir = os.path.join(self.out_dir, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}")
+        os.makedirs(run_dir, exist_ok=True)
+
+        if not self.use_cprofile:
+            with open(os.path.join(run_dir, "stacks.collapsed"), "w", encoding="utf-8") as f:
+                for stack, count in self.samples.most_common():
+                    f.write(f"{stack} {count}\n")
+
+        for table, rows in self.tables.items():
+            if not rows:
+                continue
+            with open(os.path.join(run_dir, f"{table}.csv"), "w", encoding="utf-8", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+                writer.writeheader()
+                writer.writerows(rows)
+
+        summary = self._summary(run_dir)
+        with open(os.path.join(run_dir, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(summary)
+
+        print(f"\n📊 Profile đã ghi vào: {run_dir}")
+        if not self.use_cprofile:
+            print(f"   Flamegraph: flamegraph.pl {os.path.join(run_dir, 'stacks.collapsed')} > flame.svg")
+        return run_dir
+
+    def _summary(self, run_dir):
+        out = io.StringIO()
+        total = time.perf_counter() - self._started if self._started else 0.0
+        out.write(
+            f"PROFILE: {self.name} | mode {self.mode} | wall {total:.2f}s | in stages {self.staged_time:.2f}s"
+            + ("" if self.use_cprofile else f" | sample interval {self.interval * 1000:.0f}ms")
+            + "\n"
+        )
+        if self.use_cprofile:
+            out.write(
+                "⚠️  Mode cprofile: không lấy mẫu stack (không có flamegraph/area). cProfile làm chậm code Python\n"
+                "   gọi hàm nhiều (LangChain, splitter) so với C/mạng; muốn tỉ lệ sạch thì dùng --profile sample.\n"
+            )
+        out.write("\n")
+
+        # Tỉ lệ tính trên tổng thời gian trong stage, không tính thời gian idle (chờ input, v.v.)
+        out.write("=== STAGES (% of time in stages, nested stages overlap their parent) ===\n")
+        for name, seconds in sorted(self.stage_times.items(), key=lambda x: x[1], reverse=True):
+            share = seconds / self.staged_time * 100 if self.staged_time else 0
+            out.write(f"{name:<24} {seconds:>9.3f}s {share:>6.1f}%\n")
+
+        if not self.use_cprofile:
+            out.write("\n=== TIME BY AREA (sampled, innermost library in stack) ===\n")
+            for name, areas in self.areas.items():
+                count = sum(areas.values())
+                parts = ", ".join(f"{area} {n / count * 100:.0f}%" for area, n in areas.most_common())
+                out.write(f"{name:<24} {parts}\n")
+
+            for name, totals in self.total_counts.items():
+                count = sum(self.areas[name].values())
+                selfs = self.self_counts[name]
+                out.write(f"\n=== TOP {PROFILE_TOP_N} HOT FUNCTIONS: {name} (sampled, {count} samples) ===\n")
+                out.write(f"{'self%':>6} {'total%':>7}  function\n")
+                for label, n in totals.most_common(PROFILE_TOP_N):
+                    out.write(f"{selfs[label] / count * 100:>6.1f} {n / count * 100:>7.1f}  {label}\n")
+
+        for name, profile in self.stage_profiles.items():
+            profile.dump_stats(os.path.join(run_dir, f"{name}.pstats"))
+            stream = io.StringIO()
+            stats = pstats.Stats(profile, stream=stream)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_N)
+            out.write(f"\n=== TOP {PROFILE_TOP_N} HOT FUNCTIONS: {name} (cumulative) ===\n")
+            out.write(stream.getvalue().split("\n", 1)[-1].strip() + "\n")
+
+        for table, rows in self.tables.items():
+            if rows and "ms" in rows[0]:
+                out.write(f"\n=== TOP {PROFILE_TOP_N} SLOWEST: {table} (full list in {table}.csv) ===\n")
+                for row in sorted(rows, key=lambda r: r["ms"], reverse=True)[:PROFILE_TOP_N]:
+                    out.write("  ".join(f"{k}={v}" for k, v in row.items()) + "\n")
+
+        return out.getvalue()
+
+
+def add_profile_argument(parser):
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="sample",
+        choices=PROFILE_MODES,
+        help=(
+            f"Bật profiling, ghi vào {PROFILE_DIR}/. sample (mặc định): chỉ lấy mẫu stack, overhead thấp. "
+            "cprofile: chỉ chạy cProfile, bảng top-N theo số lần gọi chính xác (chậm hơn, không có flamegraph)."
+        ),
+    )
@@ -1,9 +1,12 @@
+import argparse
 import os
 import subprocess
 import sys
 import time
 from pathlib import Path
 
+from profiler import Profiler, add_profile_argument
+
 # --- CẤU HÌNH ĐƯỜNG DẪN TUYỆT ĐỐI ---
 # Lấy thư mục chứa file smart_run.py này làm gốc
 BASE_DIR = Path(__file__).parent.resolve()
@@ -74,7 +77,11 @@ def git_backup():
         print(f"⚠️  Lỗi Git: {e}")
 
 
-def main():
+def main(profiler=None):
+    profiler = profiler or Profiler("smart_run")
+    # Profile từng script con trong process riêng của nó, ở đây chỉ đo thời gian từng bước
+    child_args = ["--profile", profiler.mode] if profiler.enabled else []
+
     print("🤖 SMART RUNNER: Polymath Second Brain")
     print(f"📂 Working Dir: {BASE_DIR}")
 
@@ -89,21 +96,33 @@ def main():
 
     # 2. Chạy Enrich (Build Data)
     print_step("1/3", "Nạp dữ liệu (Enriching)...")
-    if not run_command(["python", str(ENRICH_SCRIPT)], "Enrich Data"):
+    with profiler.stage("enrich"):
+        enrich_ok = run_command(["python", str(ENRICH_SCRIPT), *child_args], "Enrich Data")
+    if not enrich_ok:
         print("⚠️  Enrich gặp lỗi. Có muốn chạy tiếp RAG không? (y/n)")
         if input("> ").lower() != "y":
             return
 
     # 3. Chạy Git Backup (Optional)
-    git_backup()
+    with profiler.stage("git_backup"):
+        git_backup()
 
     # 4. Chạy Main RAG (Chat)
     print_step("3/3", "Khởi động Polymath Chatbot...")
-    run_command(["python", str(MAIN_SCRIPT)], "RAG Chatbot")
+    with profiler.stage("chat"):
+        run_command(["python", str(MAIN_SCRIPT), *child_args], "RAG Chatbot")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enrich notes, backup Git rồi mở chat.")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
+    profiler = Profiler("smart_run", mode=args.profile)
+    profiler.start()
     try:
-        main()
+        main(profiler)
     except KeyboardInterrupt:
         print("\n👋 Bye bro.")
+    finally:
+        profiler.dump()